@@ -38,17 +38,23 @@ numbers = [
     '-----', '.----', '..---', '...--', '....-', '.....', '-....', '--...',
     '---..', '----.']
 # Mapping of character to morse code encoding
-MORSE = dict(
-    (chr(i + ord('a')), encoded)
-    for i, encoded in enumerate(letters))
-MORSE.update(dict(
-    (chr(i + ord('0')), encoded)
-    for i, encoded in enumerate(numbers)))
+MORSE = {chr(i + ord('a')): encoded for i, encoded in enumerate(letters)}
+MORSE.update(
+    {chr(i + ord('0')): encoded for i, encoded in enumerate(numbers)})
 MORSE.update({
     '.': '.----',
     ',': '..---',
     '?': '...--'
     })
+# Table of the durations of each character's pulses, indexed by ord(char) and
+# expanded once up front so that Tapper.letter does not have to decode dihs
+# and dahs on every note. Both cases of each letter are filled in.
+_SOUNDS = {'.': DIHBLANK, '-': DAHBLANK}
+MORSE_DURATIONS = [()] * 256
+for _char, _encoded in MORSE.items():
+    _durations = tuple(_SOUNDS[sound] for sound in _encoded)
+    MORSE_DURATIONS[ord(_char)] = _durations
+    MORSE_DURATIONS[ord(_char.upper())] = _durations
 
 
 class Adsr(object):
@@ -91,14 +97,16 @@ class Tapper(object):
 
     def __init__(self, p):
         self.env = Adsr(p, attack=20, decay=10, sustain=0.8, release=20)
-        self.sound_map = {'.': DIHBLANK, '-': DAHBLANK}
 
     def out(self):
         return self.env.line
 
     def letter(self, char):
-        for sound in MORSE.get(char.lower(), []):  # Ignore unknown characters
-            for ev in self.env.pulse(self.sound_map[sound]):
+        code = ord(char)
+        # Ignore unknown characters
+        durations = MORSE_DURATIONS[code] if code < 256 else ()
+        for dur in durations:
+            for ev in self.env.pulse(dur):
                 yield ev
             yield DIHBLANK
         yield DAHBLANK
@@ -16,7 +16,6 @@
 Pure Data object placer that uses graphviz to lay out the patch.
 """
 
-import cgi
 import tempfile
 
 import pygraphviz as pgv
@@ -29,33 +28,65 @@ _TABLE_HTML = """<
 </table>
 >"""
 
+# Graphviz port names for edge endpoints, indexed by inlet/outlet number.
+# These grow on demand in _port_name.
+_INLET_PORTS = ['i%d:n' % i for i in range(64)]
+_OUTLET_PORTS = ['o%d:s' % i for i in range(64)]
+
+
+def _port_name(ports, template, idx):
+    """Returns the cached port name for the given index."""
+    while idx >= len(ports):
+        ports.append(template % len(ports))
+    return ports[idx]
+
+
+# Rows of table cells for a label's inlets and outlets, keyed by port count.
+_INLET_CELLS = {}
+_OUTLET_CELLS = {}
+
+
+def _port_cells(cells, prefix, count):
+    """Returns the cached row of table cells for the given number of ports."""
+    row = cells.get(count)
+    if row is None:
+        if count:
+            row = ''.join('<td port="%s%d" height="0"></td>' % (prefix, i)
+                          for i in range(count))
+        else:
+            row = '<td></td>'
+        cells[count] = row
+    return row
+
+
+def _format_arg(arg):
+    """Formats a box argument for display in a node label."""
+    if isinstance(arg, float):
+        return '%0.2f' % arg
+    if isinstance(arg, int):
+        return str(arg)
+    return (str(arg).replace('&', '&amp;')
+            .replace('<', '&lt;').replace('>', '&gt;'))
+
+
 class DotPlacer(object):
 
     def __init__(self):
         self.node_id = 0
         self.node_names = {}
+        # Boxes that know of at least one audio-rate inlet or outlet.
+        self.audio_port_boxes = set()
         self.graph = pgv.AGraph(directed=True, ordering='out', ranksep=0.1)
 
-    def _format_arg(self, arg):
-        if isinstance(arg, float):
-            return '%0.2f' % arg
-        return cgi.escape(str(arg))
-
     def _box_content(self, box):
-        return ' '.join([self._format_arg(arg) for arg in box.args])
+        return ' '.join([_format_arg(arg) for arg in box.args])
 
     def _label(self, box):
-        if box.inlet_count():
-            inlets = ''.join('<td port="i%d" height="0"></td>' % i
-                             for i in range(box.inlet_count()))
-        else:
-            inlets = '<td></td>'
-        if box.outlet_count():
-            outlets = ''.join('<td port="o%d" height="0"></td>' % i
-                              for i in range(box.outlet_count()))
-        else:
-            outlets = '<td></td>'
-        max_cell_count = max(1, box.inlet_count(), box.outlet_count())
+        inlet_count = box.inlet_count()
+        outlet_count = box.outlet_count()
+        inlets = _port_cells(_INLET_CELLS, 'i', inlet_count)
+        outlets = _port_cells(_OUTLET_CELLS, 'o', outlet_count)
+        max_cell_count = max(1, inlet_count, outlet_count)
         return _TABLE_HTML % (inlets,
                               max_cell_count, self._box_content(box),
                               outlets)
@@ -75,30 +106,40 @@ class DotPlacer(object):
             self.graph.add_node(name, label=self._label(box), shape='none',
                                 fontsize=10, height=box.HEIGHT / 40.0)
             self.node_names[box] = name
+            if any(box.inlets) or any(box.outlets):
+                self.audio_port_boxes.add(box)
 
     def _add_edges(self, boxes):
         for box in boxes:
             for conn in box.outgoing():
+                # Boxes placed by an earlier render are not in this layout.
+                if conn.inlet.box not in self.node_names:
+                    continue
                 weight = 2 if self._might_be_audio_rate(conn) else 1
                 self.graph.add_edge(
                     self.node_names[box], self.node_names[conn.inlet.box],
-                    headport='i%d:n' % conn.inlet.idx,
-                    tailport='o%d:s' % conn.outlet.idx,
+                    headport=_port_name(
+                        _INLET_PORTS, 'i%d:n', conn.inlet.idx),
+                    tailport=_port_name(
+                        _OUTLET_PORTS, 'o%d:s', conn.outlet.idx),
                     arrowhead='tee', weight=weight)
 
     def _might_be_audio_rate(self, conn):
+        from_box = conn.outlet.box
+        to_box = conn.inlet.box
+        # Guess that two audio-rate boxes are connected by an audio-rate
+        # signal.
+        if from_box.audio_rate and to_box.audio_rate:
+            return True
         # For canvases, we know exactly which ports are audio rate.
+        # Other boxes have no audio ports recorded, so skip the port lookups.
         # TODO: it would be clear if the patch method would note
         # if it is connecting an audio-rate port.
-        from_box = conn.outlet.box
-        if from_box.outlets and from_box.outlets[conn.outlet.idx]:
-            return True
-        to_box = conn.inlet.box
-        if to_box.inlets and to_box.inlets[conn.inlet.idx]:
+        if (from_box in self.audio_port_boxes and
+                from_box.outlets[conn.outlet.idx]):
             return True
-        # For other boxes, guess that two audio-rate boxes are connected
-        # by an audio-rate signal.
-        return from_box.audio_rate and to_box.audio_rate
+        return bool(to_box in self.audio_port_boxes and
+                    to_box.inlets[conn.inlet.idx])
 
     def place_all(self, boxes):
         self._add_nodes(boxes)
@@ -109,6 +150,8 @@ class DotPlacer(object):
         # For debugging:
         #self.graph.draw(tempfile.mkstemp(suffix='.dot')[1])
         #self.graph.draw(tempfile.mkstemp(suffix='.png')[1])
-        return dict(
-            (box, self._parse_coord(self.graph.get_node(self.node_names[box])))
-            for box in boxes)
+        # Read back every node's position in one pass over the graph, rather
+        # than looking each node up by name.
+        boxes_by_name = {name: box for box, name in self.node_names.items()}
+        return {boxes_by_name[node]: self._parse_coord(node)
+                for node in self.graph.nodes_iter() if node in boxes_by_name}
@@ -29,31 +29,34 @@ from __future__ import print_function
 
 import functools
 import heapq
+import itertools
 import logging
 import time
-try:
-  from functools import total_ordering
-except ImportError:
-  from .total_ordering import total_ordering
 
 __all__ = ['Mta', 'Beat', 'Time', 'forever', 'measure']
 
+# Scheduling is measured against a monotonic clock so that wall-clock
+# adjustments do not make events fire early or late. The integer nanosecond
+# clock avoids the rounding of the float seconds clock.
+if hasattr(time, 'monotonic_ns'):
+    def _clock_ms():
+        return time.monotonic_ns() / 1000000.0
+elif hasattr(time, 'monotonic'):
+    def _clock_ms():
+        return time.monotonic() * 1000
+else:  # python 2
+    def _clock_ms():
+        return time.time() * 1000
+
 
-@total_ordering
 class ScheduledEvent(object):
-    """An event scheduled to happen at a given absolute time."""
+    """Handle for an event iterator that has been added to the scheduler."""
 
-    def __init__(self, data, abs_time_ms):
+    def __init__(self, data):
         self.data = data
-        self.abs_time_ms = abs_time_ms
         self.stopped = False
         self.cancelled = False
 
-    def __lt__(self, other):
-        if not other.abs_time_ms:
-            return False
-        return self.abs_time_ms < other.abs_time_ms
-
     def cancel(self):
         """Cancel this event immediately."""
         self.cancelled = True
@@ -62,9 +65,6 @@ class ScheduledEvent(object):
         """Stop this event after it fires next."""
         self.stopped = True
 
-    def __str__(self):
-        return 'Event @ %s' % self.abs_time_ms
-
 
 class Mta(object):
     """Event scheduler. Stands for Metronomic Timing Activity.
@@ -75,34 +75,66 @@ class Mta(object):
 
     Attributes:
       bpm: beats per minute, used for enqueueing time measured in beats.
-      scheduler: a heap of upcoming events.
+      scheduler: a heap of (abs_time_ms, sequence, event) tuples.
       tm: the current absolute time in milliseconds.
     """
     def __init__(self, bpm):
         self.bpm = bpm
         self.scheduler = []
         self.tm = None
+        # Breaks ties between events scheduled for the same time, so that
+        # they fire in the order they were enqueued.
+        self._counter = itertools.count()
+
+    @property
+    def bpm(self):
+        return self._bpm
+
+    @bpm.setter
+    def bpm(self, bpm):
+        self._bpm = bpm
+        # Length of one beat, so enqueueing a Beat is a single multiply.
+        self._beat_ms = beats_to_ms(bpm, 1)
 
     def add(self, ev_iter):
         """Add an iterator to the scheduler."""
-        if not self.tm:
+        if self.tm is None:
             # Lazily initialize the clock if necessary.
             self.tm = self._now()
-        return self._enqueue(ev_iter, Time(0))
+        return self._enqueue(ScheduledEvent(ev_iter), Time(0))
+
+    def add_all(self, ev_iters):
+        """Add several iterators to the scheduler at once.
 
-    def _enqueue(self, ev_iter, delay):
+        Returns:
+          A list of the scheduled events, in the same order as ev_iters.
+        """
+        if self.tm is None:
+            self.tm = self._now()
+        events = [ScheduledEvent(ev_iter) for ev_iter in ev_iters]
+        # Extending and re-heapifying is linear, rather than pushing each.
+        self.scheduler.extend(
+            (self.tm, next(self._counter), event) for event in events)
+        heapq.heapify(self.scheduler)
+        return events
+
+    def _enqueue(self, event, delay):
         """Schedule an event."""
         assert isinstance(delay, RelativeTime)
-        abs_time_ms = self.tm + delay.to_ms(self.bpm)
-        event = ScheduledEvent(ev_iter, abs_time_ms)
-        heapq.heappush(self.scheduler, event)
+        if type(delay) is Beat:
+            delay_ms = delay.count * self._beat_ms
+        else:
+            delay_ms = delay.to_ms(self._bpm)
+        abs_time_ms = self.tm + delay_ms
+        heapq.heappush(self.scheduler,
+                       (abs_time_ms, next(self._counter), event))
         return event
 
     def _sleep(self, delay_ms):
         time.sleep(delay_ms / 1000.0)
 
     def _now(self):
-        return time.time() * 1000
+        return _clock_ms()
 
     def tick(self):
         """Advances the clock and fires any events that are ready.
@@ -111,39 +143,53 @@ class Mta(object):
           The delay (in ms) until the next event, or None if there are
         no more events.
         """
-        self.tm = self._now()
-        logging.debug('firing events at %0.0f', self.tm)
-        while self.scheduler and self.scheduler[0].abs_time_ms <= self.tm:
-            ev = heapq.heappop(self.scheduler)
-            delay_ms = ev.abs_time_ms - self.tm
+        self.tm = tm = self._now()
+        logging.debug('firing events at %0.0f', tm)
+        # Local aliases keep attribute lookups out of the drain loop.
+        scheduler = self.scheduler
+        heappop = heapq.heappop
+        fire_event = self._fire_event
+        while scheduler and scheduler[0][0] <= tm:
+            abs_time_ms, _, ev = heappop(scheduler)
+            delay_ms = abs_time_ms - tm
             if delay_ms < -10:
                 logging.warn('fell behind by %0.2f ms', abs(delay_ms))
-            self._fire_event(ev)
-        if self.scheduler:
-            return self.scheduler[0].abs_time_ms - self.tm
+            fire_event(ev)
+        if scheduler:
+            return scheduler[0][0] - tm
 
     def _fire_event(self, event):
         if event.cancelled:
             return
-        next_delay = next(event.data, None)
+        try:
+            next_delay = next(event.data)
+        except StopIteration:
+            return
         if next_delay and not event.stopped:
-            self._enqueue(event.data, next_delay)
+            self._enqueue(event, next_delay)
 
     def loop(self):
         """Run until all events are consumed, sleeping between them."""
         while True:
-            delay_until_next = self.tick()
-            if not delay_until_next:
+            if self.tick() is None:
                 break
-            self._sleep(delay_until_next)
+            # Measure the delay against the clock again rather than using
+            # tick's return value, so that time spent firing events does not
+            # push every later event back.
+            delay_until_next = self.scheduler[0][0] - self._now()
+            if delay_until_next > 0:
+                self._sleep(delay_until_next)
+
+
+_MS_PER_MINUTE = 60000.0
 
 
 def beats_to_ms(bpm, beats):
-    return beats * 1000 * 60.0 / bpm
+    return beats * _MS_PER_MINUTE / bpm
 
 
 def ms_to_beats(bpm, ms):
-    return ms * bpm / (1000 * 60)
+    return ms * bpm / _MS_PER_MINUTE
 
 
 class RelativeTime:
@@ -234,9 +280,7 @@ def example3():
 
 def main():
     mta = Mta(60)
-    mta.add(example())
-    mta.add(example2())
-    mta.add(example3())
+    mta.add_all([example(), example2(), example3()])
     mta.loop()
 
 if __name__ == '__main__':
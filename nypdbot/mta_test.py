@@ -141,6 +141,34 @@ class MtaTest(unittest.TestCase):
         scheduler.loop()
         self.assertEquals('a b aa bb cc dd', ' '.join(self.output))
 
+    def testCancel_afterFiring(self):
+        scheduler = UntimedMta()
+        p1 = scheduler.add(self.go())
+        scheduler.tick()
+        p1.cancel()
+        scheduler._sleep(10)
+        scheduler.tick()
+        self.assertEquals(['a', 'b'], self.output)
+
+    def testSimultaneousEvents_fireInOrder(self):
+        def go(name):
+            self.out(name)
+            yield mta.Time(1)
+            self.out(name)
+        scheduler = UntimedMta()
+        for name in 'abcde':
+            scheduler.add(go(name))
+        scheduler.loop()
+        self.assertEquals('abcdeabcde', ''.join(self.output))
+
+    def testAddAll(self):
+        scheduler = UntimedMta()
+        scheduler.add(self.go())
+        p1, p2 = scheduler.add_all([self.spawn2(), self.spawn2()])
+        p2.cancel()
+        scheduler.loop()
+        self.assertEquals('a b aa bb c d cc dd', ' '.join(self.output))
+
 class BeatTest(unittest.TestCase):
     def testToMs(self):
         beat = mta.Beat()
@@ -156,5 +184,26 @@ class BeatTest(unittest.TestCase):
         self.assertEquals(500, beat.to_ms(60))
 
 
+class BpmTest(unittest.TestCase):
+    def testTempoChange(self):
+        scheduler = UntimedMta()
+        def go():
+            yield mta.Beat()
+        scheduler.add(go())
+        self.assertEquals(1000, scheduler.tick())
+        scheduler.bpm = 120
+        scheduler.add(go())
+        self.assertEquals(500, scheduler.tick())
+
+
+class MeasureTest(unittest.TestCase):
+    def testFillsMeasure(self):
+        @mta.measure(4)
+        def shard(count):
+            yield mta.Beat(0.5)
+            yield mta.Beat(count)
+        self.assertEquals([0.5, 1, 2.5], [b.count for b in shard(1)])
+
+
 if __name__ == '__main__':
     unittest.main()
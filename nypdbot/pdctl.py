@@ -21,11 +21,17 @@ Pure Data object graph manipulation library.
 from __future__ import print_function
 
 import collections
+import contextlib
 import logging
 import re
 import socket
 import time
 
+try:
+    from collections.abc import Iterable
+except ImportError:  # python 2
+    from collections import Iterable
+
 try:
     from . import dotplacer
 except ImportError:
@@ -36,6 +42,10 @@ __all__ = ['Pd']
 # This must match the port in driver.pd
 SEND_PORT = 2001
 
+# Kernel send buffer size for the connection to pd, large enough that
+# rendering a big patch does not block waiting for pd to read it.
+SEND_BUFFER_SIZE = 1 << 20
+
 # Classes for creating particular PD objects. Obj can be used to create any
 # object, but you can register a class here to provide more specialized methods.
 # See Recv as an example.
@@ -49,10 +59,18 @@ def register(cls):
 
 class Connection(object):
 
+    __slots__ = ('outlet', 'inlet')
+
     def __init__(self, outlet, inlet):
         self.outlet = outlet
         self.inlet = inlet
-        self.rendered = False
+
+
+def _port_list(lists, idx):
+    """Returns lists[idx], growing lists as needed."""
+    while len(lists) <= idx:
+        lists.append([])
+    return lists[idx]
 
 
 class Box(object):
@@ -65,8 +83,15 @@ class Box(object):
     a.out0.patch(b.in0).
     """
 
+    # Boxes are created in bulk, so none of them carry a __dict__. Subclasses
+    # must declare __slots__ for any attributes they add.
+    __slots__ = ('pd', 'args', '_children', '_parents', '_ports', 'canvas',
+                 'rendered', 'audio_rate', 'inlets', 'outlets', 'x', 'y', 'id')
+
     CREATION_COMMAND = None
     HEIGHT = 18
+    # The object name, for boxes that have one.
+    name = None
     _unique_name_count = -1
 
     def __init__(self, pd, *args, **kwargs):
@@ -75,8 +100,15 @@ class Box(object):
                 'Object parents may be passed only as keyword arguments.')
         self.pd = pd
         self.args = args
-        self._children = collections.defaultdict(list)
-        self._parents = collections.defaultdict(list)
+        # Outgoing connections and parent boxes, indexed by port number.
+        # Many boxes are never patched, so these share an empty tuple until
+        # the first connection.
+        self._children = ()
+        self._parents = ()
+        # Inlet and Outlet objects, keyed by (class, index).
+        self._ports = {}
+        # The canvas this box has been added to, if any.
+        self.canvas = None
         self.rendered = False
         self.audio_rate = False
 
@@ -92,7 +124,11 @@ class Box(object):
         self.id = None
 
         for attr, other in kwargs.items():
-            if not isinstance(other, collections.Iterable):
+            # Check for the common cases of a single box or a list of them
+            # before falling back on the slower Iterable ABC check.
+            if isinstance(other, (list, tuple)):
+                pass
+            elif isinstance(other, Box) or not isinstance(other, Iterable):
                 other = [other]
             for obj in other:
                 obj.patch(getattr(self, attr))
@@ -106,13 +142,27 @@ class Box(object):
 
     def __getattr__(self, name):
         if name.startswith('out'):
-            return Outlet(self, int(name[3:]))
+            port_class, idx = Outlet, name[3:]
         elif name.startswith('in'):
-            return Inlet(self, int(name[2:]))
-        raise AttributeError(name)
+            port_class, idx = Inlet, name[2:]
+        else:
+            raise AttributeError(name)
+        # Names like 'index' or 'outline' are not ports.
+        if not idx.isdigit():
+            raise AttributeError(name)
+        return self._port(port_class, int(idx))
+
+    def _port(self, port_class, idx):
+        """Returns the cached Inlet or Outlet with the given index."""
+        key = (port_class, idx)
+        port = self._ports.get(key)
+        if port is None:
+            port = self._ports[key] = port_class(self, idx)
+        return port
 
     def patch(self, other):
-        return self.out0.patch(other)
+        # Skips __getattr__, as this is the most common way to patch.
+        return self._port(Outlet, 0).patch(other)
 
     def place(self, coords, box_id):
         self.x, self.y = coords
@@ -120,7 +170,7 @@ class Box(object):
         return self._creation_commands()
 
     def is_placed(self):
-        return bool(self.x)
+        return self.x is not None
 
     def _creation_commands(self):
         assert self.CREATION_COMMAND
@@ -130,20 +180,30 @@ class Box(object):
 
     def _patch(self, inlet, outlet):
         assert outlet.box is self
-        self._children[outlet.idx].append(Connection(outlet, inlet))
-        inlet.box._parents[inlet.idx].append(self)
+        conn = Connection(outlet, inlet)
+        if not self._children:
+            self._children = []
+        _port_list(self._children, outlet.idx).append(conn)
+        if self.canvas is not None:
+            self.canvas.connections.append(conn)
+        child = inlet.box
+        if not child._parents:
+            child._parents = []
+        _port_list(child._parents, inlet.idx).append(self)
         return inlet.box
 
     def inlet_count(self):
+        """Returns the number of inlets up to the last connected one."""
         return len(self._parents)
 
     def outlet_count(self):
+        """Returns the number of outlets up to the last connected one."""
         return len(self._children)
 
     def parents(self):
         """Yields the boxes connected to the inlets of this box."""
-        for i in sorted(self._parents):
-            for obj in self._parents[i]:
+        for parents in self._parents:
+            for obj in parents:
                 yield obj
 
     def children(self):
@@ -153,17 +213,25 @@ class Box(object):
 
     def outgoing(self):
         """Yields Connection objects for the outlets of this box."""
-        for i in sorted(self._children):
-            for conn in self._children[i]:
+        for conns in self._children:
+            for conn in conns:
                 yield conn
 
     def parent(self):
       """Return the left-most parent, if any."""
-      return next(self.parents(), None)
+      # Looked up directly rather than through parents(), as the placers
+      # call this for every box.
+      for parents in self._parents:
+          if parents:
+              return parents[0]
+      return None
 
     def child(self):
       """Return the left-most child, if any."""
-      return next(self.children(), None)
+      for conns in self._children:
+          if conns:
+              return conns[0].inlet.box
+      return None
 
     def __repr__(self):
         return '%s(%s)' % (
@@ -176,6 +244,8 @@ class Inlet(object):
 
     This is *not* a Pure Data [inlet] object.
     """
+    __slots__ = ('box', 'idx')
+
     def __init__(self, box, idx):
         self.box = box
         self.idx = idx
@@ -186,6 +256,8 @@ class Outlet(object):
 
     This is *not* a Pure Data [outlet] object.
     """
+    __slots__ = ('box', 'idx')
+
     def __init__(self, box, idx):
         self.box = box
         self.idx = idx
@@ -193,7 +265,7 @@ class Outlet(object):
     def patch(self, other):
         """Connects this outlet to the given inlet."""
         if (isinstance(other, Box)):
-            inlet = other.in0
+            inlet = other._port(Inlet, 0)
         else:
             inlet = other
         return self.box._patch(inlet, self)
@@ -202,27 +274,35 @@ class Outlet(object):
 @register
 class Msg(Box):
     """A [message( box."""
+    __slots__ = ()
     CREATION_COMMAND = 'msg'
 
     # N.B. To get a message like "1 2, 3 4", call:
     # Msg(1, 2, ',', 3, 4)
 
-    def __init__(self, *args, **kwargs):
-        args = tuple(arg.replace(',', r'\,') for arg in args)
-        super(Msg, self).__init__(*args, **kwargs)
+    def __init__(self, pd, *args, **kwargs):
+        # Only strings can contain commas; leave everything else untouched.
+        args = tuple(
+            arg.replace(',', r'\,')
+            if isinstance(arg, str) and ',' in arg else arg
+            for arg in args)
+        super(Msg, self).__init__(pd, *args, **kwargs)
 
 @register
 class Number(Box):
     """A number box."""
+    __slots__ = ()
     CREATION_COMMAND = 'floatatom'
 
 @register
 class Symbol(Box):
     """A symbol box."""
+    __slots__ = ()
     CREATION_COMMAND = 'symbolatom'
 
 class Gui(Box):
     """A graphical box."""
+    __slots__ = ('name',)
 
     def __init__(self, pd, name=None, **kwargs):
         name = name or self.gen_name()
@@ -247,16 +327,19 @@ class Gui(Box):
 @register
 class Bang(Gui):
     """A [bang] box."""
+    __slots__ = ()
     CREATION_COMMAND = 'bng'
 
 @register
 class HSlider(Gui):
     """A [message( box."""
+    __slots__ = ()
     CREATION_COMMAND = 'hslider'
 
 @register
 class VSlider(Gui):
     """A [message( box."""
+    __slots__ = ()
 
     CREATION_COMMAND = 'vslider'
     HEIGHT = 128
@@ -265,6 +348,7 @@ class VSlider(Gui):
 @register
 class Obj(Box):
     """A generic object box, e.g. [print foo]."""
+    __slots__ = ('name',)
     CREATION_COMMAND = 'obj'
 
     def __init__(self, pd, *args, **kwargs):
@@ -275,6 +359,7 @@ class Obj(Box):
 @register
 class Recv(Obj):
     """An [r] object."""
+    __slots__ = ('selector',)
 
     def __init__(self, pd, selector=None):
         selector = selector or self.gen_name('recv')
@@ -291,49 +376,64 @@ class Placer(object):
 
     TOP = 10
     LEFT = 10
+    y_step = 20
+    x_step = 80
 
-    def __init__(self, test_mode=False):
-        if test_mode:
-            # For test purposes, place all objects at (-1, -1).
-            self.TOP = -1
-            self.LEFT = -1
-            self.y_step = 0
-            self.x_step = 0
-        else:
-            self.y_step = 20
-            self.x_step = 80
+    def __init__(self):
         self.left = self.LEFT
-        self.coords = {}
-        # Count of children of each object
-        self.children = collections.defaultdict(int)
 
     def place_all(self, boxes):
-        to_place = [box for box in boxes if not box.parent()]
+        # Each box is placed relative to its left-most parent, so a box is
+        # queued once that parent has been placed and never needs a retry.
+        # The queue carries each box's position, worked out from its parent
+        # as the box is queued, so no per-box lookups are needed to place it.
+        pending = set(boxes)
+        to_place = collections.deque()
+        # Boxes whose parent was placed by an earlier render start right away,
+        # below that parent.
+        siblings = {}
+        for box in boxes:
+            parent = box.parent()
+            if parent in pending:
+                continue
+            if parent is not None and parent.is_placed():
+                if parent not in siblings:
+                    # Start after the children placed below it earlier.
+                    siblings[parent] = len(set(
+                        child for child in parent.children()
+                        if child.is_placed() and child.parent() is parent))
+                to_place.append(
+                    (box, parent.x + self.x_step * siblings[parent],
+                     parent.y + self.y_step))
+                siblings[parent] += 1
+            else:
+                self.left += self.x_step
+                to_place.append((box, self.left, self.TOP))
+        # Boxes that have been queued, so that a child connected to several
+        # outlets of its parent is only queued once.
+        queued = set(entry[0] for entry in to_place)
         placed = {}
         while to_place:
-            box = to_place.pop(0)
-            if box in self.coords:
-                continue
-            coords = self.place(box)
-            if not coords:
-                to_place.append(box)
-                continue
-            self.coords[box] = placed[box] = coords
-            to_place.extend(box.children())
+            box, left, top = to_place.popleft()
+            placed[box] = (left, top)
+            child_left = left
+            for child in box.children():
+                if (child in pending and child not in queued and
+                        child.parent() is box):
+                    queued.add(child)
+                    to_place.append((child, child_left, top + self.y_step))
+                    child_left += self.x_step
         return placed
 
-    def place(self, obj):
-        parent = obj.parent()
-        if not parent:
-            self.left += self.x_step
-            return self.left, self.TOP
-        if parent not in self.coords:
-            return
-        px, py = self.coords[parent]
-        left = px + self.x_step * self.children[parent]
-        top = py + self.y_step
-        self.children[parent] += 1
-        return left, top
+
+class TestPlacer(Placer):
+    """For test purposes, places all objects at (-1, -1)."""
+
+    TOP = -1
+    LEFT = -1
+    y_step = 0
+    x_step = 0
+
 
 # If pygraphviz is available, use it for smarter object placement.
 if dotplacer:
@@ -350,6 +450,8 @@ else:
 _SPECIAL_CHARACTERS = {
     '__': '/',
 }
+_SPECIAL_CHARACTERS_RE = re.compile(
+    '|'.join(re.escape(python_name) for python_name in _SPECIAL_CHARACTERS))
 _CAPS_RE = re.compile(r'(.)([A-Z])')
 
 # Table of special object names, with optional trailing tilde.
@@ -372,8 +474,17 @@ _SPECIAL_NAMES = {
     'mod': '%',
 }
 
+# Cache of translated object names, as patches reuse the same few objects.
+_PD_OBJ_NAMES = {}
+
 def _pd_obj_name(name):
     """Translates a python attribute name into a Pure Data object name."""
+    pd_name = _PD_OBJ_NAMES.get(name)
+    if pd_name is None:
+        pd_name = _PD_OBJ_NAMES[name] = _translate_obj_name(name)
+    return pd_name
+
+def _translate_obj_name(name):
     # Place a hyphen before every non-initial [A-Z].
     name = _CAPS_RE.sub(lambda m: '%s-%s' % m.groups(), name).lower()
 
@@ -383,13 +494,17 @@ def _pd_obj_name(name):
     if name in _SPECIAL_NAMES:
         name = _SPECIAL_NAMES[name]
     else:
-        for python_name, pd_name in _SPECIAL_CHARACTERS.items():
-            name = name.replace(python_name, pd_name)
+        name = _SPECIAL_CHARACTERS_RE.sub(
+            lambda m: _SPECIAL_CHARACTERS[m.group(0)], name)
     if audio_rate:
         name += '~'
     return name
 
 
+# Serialized form of a connect command, which consists only of integers.
+_CONNECT_FUDI = b'connect %d %d %d %d;'
+
+
 @register
 class Canvas(Obj):
     """Reprents a Pd canvas, keeping track of objects added to it.
@@ -407,15 +522,32 @@ class Canvas(Obj):
     p.Lt_(0.5). In addition, this is an escape hatch in case an object
     is not expressible as a Python-legal name.
     """
+    __slots__ = ('_creators', 'canvas_name', 'fudi_selector', 'boxes',
+                 'pending_boxes', 'connections', 'rendered_connections',
+                 'next_box_id', 'interactive')
+
+    # Seconds to wait between the simulated mouse events that place a GUI box.
+    GUI_EVENT_DELAY = 0.01
 
     def __init__(self, pd, canvas_name, *args):
+        # Object creation functions handed out by __getattr__, by attribute.
+        # This must be set first, as __getattr__ relies on it.
+        self._creators = {}
         # TODO: **kwargs not supported here, as the connection commands would
         # come from the child patch when they need to come from
         # the parent patch.
         super(Canvas, self).__init__(pd, 'pd', canvas_name, *args)
         self.pd = pd
         self.canvas_name = canvas_name
+        # The serialized 'pd-<name> ' prefix of every command to this canvas.
+        self.fudi_selector = fudi_escape('pd-' + canvas_name) + b' '
         self.boxes = []
+        # Boxes added since the last render, in order.
+        self.pending_boxes = []
+        # Every connection from a box on this canvas, in patching order.
+        # The first rendered_connections of them have been sent to pd.
+        self.connections = []
+        self.rendered_connections = 0
         self.inlets = []
         self.outlets = []
         self.next_box_id = 0  # Track the 0-based ids assigned by pure data.
@@ -425,26 +557,34 @@ class Canvas(Obj):
             self.rendered = True
 
     def __getattr__(self, name):
-        if name[0].islower():
-            # Fall back on parent class, for inlet and outlet attributes.
+        # Fall back on parent class, for inlet and outlet attributes. That
+        # also rejects private names and protocol probes like __deepcopy__.
+        if name[0].islower() or name[0] == '_':
             return super(Canvas, self).__getattr__(name)
-        # Uppercased or special-character attributes are for object creation.
-        return self._create_object(name)
+        # Uppercased attributes are for object creation.
+        create = self._creators.get(name)
+        if create is None:
+            create = self._creators[name] = self._create_object(name)
+        return create
 
     def _create_object(self, name):
-        """Create a Pure Data object."""
-        def create(*args, **kwargs):
-            constructor = PD_OBJECTS.get(name)
-            if constructor:
-                box = constructor(self.pd, *args, **kwargs)
-            else:
-                box = Obj(self.pd, _pd_obj_name(name), *args, **kwargs)
-            return self.add(box)
+        """Returns a function that creates the named Pure Data object."""
+        constructor = PD_OBJECTS.get(name)
+        if constructor:
+            def create(*args, **kwargs):
+                return self.add(constructor(self.pd, *args, **kwargs))
+        else:
+            pd_name = _pd_obj_name(name)
+            def create(*args, **kwargs):
+                return self.add(Obj(self.pd, pd_name, *args, **kwargs))
         return create
 
     def add(self, box):
         """Add the given box to the canvas."""
         self.boxes.append(box)
+        box.canvas = self
+        # Connections made from now on are recorded by Box._patch.
+        self.connections.extend(box.outgoing())
 
         if box.name == 'inlet' or box.name == 'inlet~':
             self.inlets.append(box.audio_rate)
@@ -454,6 +594,8 @@ class Canvas(Obj):
         if self.interactive:
             # TODO: determine coordinates.
             self._render_box(box, (10, 10))
+        else:
+            self.pending_boxes.append(box)
         # Chainable so you can write box = canvas.add(Box(...))
 
         return box
@@ -465,92 +607,199 @@ class Canvas(Obj):
         where future object additions happen right away. Set the
         interactive attribute to False to go back to batch mode.
         """
-        boxes_to_place = [box for box in self.boxes if not box.is_placed()]
+        boxes_to_place, self.pending_boxes = self.pending_boxes, []
         placer = PLACER_CLASS()
         coords = placer.place_all(boxes_to_place)
 
-        for box in boxes_to_place:
-            self._render_box(box, coords[box])
+        with self.pd.batch():
+            for box in boxes_to_place:
+                self._render_box(box, coords[box])
 
-        for box in self.boxes:
-            for conn in box.outgoing():
-                self._maybe_render_conn(conn)
+            # Count each connection as it is sent, so that if one fails the
+            # next render does not send the earlier ones again.
+            connections = self.connections
+            while self.rendered_connections < len(connections):
+                self._render_conn(connections[self.rendered_connections])
+                self.rendered_connections += 1
 
         self.interactive = True
 
     def _render_box(self, box, coords):
         creation_commands = box.place(coords, self.next_box_id)
         self.next_box_id += 1
-        for cmd in creation_commands:
-            self.send_cmd(*cmd)
+        pace = isinstance(box, Gui)
+        for i, cmd in enumerate(creation_commands):
             # Hack: if mouse events happen too quickly, pd gets confused
-            # and places objects in the wrong spot.
-            if isinstance(box, Gui):
-                time.sleep(0.01)
-        if hasattr(box, 'render'):
+            # and places objects in the wrong spot. Only the simulated mouse
+            # events that follow a GUI's creation command need spacing out;
+            # everything else stays in the current batch.
+            if pace and i:
+                self.pd.flush()
+                time.sleep(self.GUI_EVENT_DELAY)
+            self.send_cmd(*cmd)
+        if isinstance(box, Canvas):
             box.render()
 
-    def _maybe_render_conn(self, conn):
-        if not conn.rendered:
-            conn.rendered = True
-            self.send_cmd(
-                'connect', conn.outlet.box.id, conn.outlet.idx,
-                conn.inlet.box.id, conn.inlet.idx)
+    def _render_conn(self, conn):
+        # Skip connections to or from boxes that are not on this canvas,
+        # such as boxes removed by clear(), or that have not been rendered.
+        from_box = conn.outlet.box
+        to_box = conn.inlet.box
+        if (from_box.canvas is not self or to_box.canvas is not self or
+                from_box.id is None or to_box.id is None):
+            return
+        # Connect commands are all integers, so they skip to_fudi.
+        self.pd.send_fudi(self.fudi_selector + _CONNECT_FUDI % (
+            from_box.id, conn.outlet.idx, to_box.id, conn.inlet.idx))
 
     def send_cmd(self, *args):
         """Sends a command to this canvas in Pure Data."""
-        self.pd.send_cmd('pd-' + self.canvas_name, *args)
+        self.pd.send_fudi(self.fudi_selector + to_fudi(args))
 
     def clear(self):
         """Removes all boxes from this canvas."""
+        # The removed boxes no longer belong to this canvas, and their ids
+        # will be reused by the boxes added after clearing it.
+        for box in self.boxes:
+            box.canvas = None
+            box.x = box.y = box.id = None
         self.boxes = []
+        self.pending_boxes = []
+        self.connections = []
+        self.rendered_connections = 0
+        # Pure data numbers the boxes of a cleared canvas from 0 again.
+        self.next_box_id = 0
         self.send_cmd('clear')
 
 
+def _creation_method(constructor):
+    def create(self, *args, **kwargs):
+        return self.add(constructor(self.pd, *args, **kwargs))
+    create.__name__ = constructor.__name__
+    return create
+
+
+# Give Canvas a real method for each box class registered so far, so that
+# e.g. canvas.Msg(...) is found without going through __getattr__.
+# Classes registered later are still created by __getattr__.
+for _name, _constructor in PD_OBJECTS.items():
+    setattr(Canvas, _name, _creation_method(_constructor))
+del _name, _constructor
+
+
 class PdSend(object):
     """Sends messages to Pure Data."""
     def __init__(self, port=SEND_PORT):
         self.conn = socket.create_connection(('localhost', port))
+        # Messages are already coalesced by Pd.batch(), so don't let Nagle's
+        # algorithm hold back the ones that are sent on their own.
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.conn.setsockopt(
+            socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
         logging.debug('Sender connected')
 
     def send(self, cmd):
         logging.debug(cmd)
-        self.conn.send(cmd)
+        # send() may write only part of the message; sendall() retries.
+        self.conn.sendall(cmd)
+
+    def send_many(self, cmds):
+        """Sends several messages with a single write."""
+        # Skip the per-message logging calls entirely unless they would log.
+        if logging.root.isEnabledFor(logging.DEBUG):
+            for cmd in cmds:
+                logging.debug(cmd)
+        self.conn.sendall(b'\n'.join(cmds))
 
 
 class FakePdSend(object):
+    """Records messages instead of sending them, printing them if verbose."""
+    def __init__(self, verbose=False):
+        self.sent = []
+        self.verbose = verbose
+
     def send(self, cmd):
-        print(cmd)
+        self.sent.append(cmd)
+        if self.verbose:
+            print(cmd)
+
+    def send_many(self, cmds):
+        for cmd in cmds:
+            self.send(cmd)
+
+
+def _encode_atom(serialized):
+    # Most atoms contain no semicolon, so only those that do are rescanned.
+    if ';' in serialized:
+        serialized = serialized.replace(';', '\\;')
+    return serialized.encode('utf-8')
 
 
 def fudi_escape(arg):
+    """Serialize a single object into an encoded PD protocol atom."""
+    cls = arg.__class__
+    if cls is str:
+        return _encode_atom(arg)
+    if cls is int or cls is float:
+        # Numbers never contain a semicolon.
+        return str(arg).encode('ascii')
     if hasattr(arg, 'to_fudi'):
-        serialized = arg.to_fudi()
-    else:
-        serialized = str(arg)
-    return serialized.replace(';', r'\;')
+        return _encode_atom(arg.to_fudi())
+    return _encode_atom(str(arg))
 
 
 def to_fudi(args):
     """Serialize a list of objects into a PD protocol message."""
-    msg = ' '.join(fudi_escape(arg) for arg in args) + ';'
-    return msg.encode('utf-8')
+    return b' '.join([fudi_escape(arg) for arg in args]) + b';'
 
 
 class Pd(object):
     def __init__(self, sender=None):
         self.sender = sender or PdSend()
+        # Messages queued by batch(), or None when sending immediately.
+        self.pending = None
         self.main = Canvas(self, '__main__')
 
     def dsp(self, on):
         self.send_cmd('pd', 'dsp', 1 if on else 0)
 
     def send_cmd(self, *args):
-        self.sender.send(to_fudi(args))
+        self.send_fudi(to_fudi(args))
+
+    def send_fudi(self, msg):
+        """Sends a message that has already been serialized by to_fudi."""
+        if self.pending is None:
+            self.sender.send(msg)
+        else:
+            self.pending.append(msg)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Queues commands sent within the block and sends them together.
+
+        Nested batches are folded into the outermost one.
+        """
+        if self.pending is not None:
+            yield
+            return
+        self.pending = []
+        try:
+            yield
+        finally:
+            try:
+                self.flush()
+            finally:
+                self.pending = None
+
+    def flush(self):
+        """Sends any commands queued by batch() right away."""
+        if self.pending:
+            pending, self.pending = self.pending, []
+            self.sender.send_many(pending)
 
 
 def main():
-    pd = Pd(sender=FakePdSend())
+    pd = Pd(sender=FakePdSend(verbose=True))
 
     patch = pd.main
     lb = patch.metro(500)
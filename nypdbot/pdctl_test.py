@@ -14,24 +14,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import socket
+import threading
 import unittest
 
 from . import pdctl
 
 
-class TestPdSend(pdctl.PdSend):
+class TestPdSend(pdctl.FakePdSend):
     def __init__(self):
-        self.sent = []
+        super(TestPdSend, self).__init__()
+        self.batches = []
 
-    def send(self, cmd):
-        self.sent.append(cmd)
+    def send_many(self, cmds):
+        super(TestPdSend, self).send_many(cmds)
+        self.batches.append(len(cmds))
 
 class PdTest(unittest.TestCase):
 
     def setUp(self):
         self.sender = TestPdSend()
         self.pd = pdctl.Pd(sender=self.sender)
-        pdctl.PLACER_CLASS = lambda: pdctl.Placer(test_mode=True)
+        pdctl.PLACER_CLASS = pdctl.TestPlacer
 
     def testSmoke(self):
         # Add some arbitrary objects.
@@ -60,10 +64,106 @@ class PdTest(unittest.TestCase):
                 b'pd dsp 1;',
             ],
             self.sender.sent)
+        self.assertEquals([8], self.sender.batches)
         self.assertTrue(patch.interactive)
         for box in patch.boxes:
             self.assertTrue(box.is_placed())
 
+    def testIncrementalRender(self):
+        patch = self.pd.main
+        a = patch.A()
+        b = patch.B()
+        a.patch(b)
+        patch.render()
+        del self.sender.sent[:]
+
+        patch.interactive = False
+        c = patch.C()
+        b.patch(c)
+        patch.render()
+        self.assertEquals(
+            [
+                b'pd-__main__ obj -1 -1 c;',
+                b'pd-__main__ connect 1 0 2 0;',
+            ],
+            self.sender.sent)
+
+    def testIncrementalRender_placesBesideEarlierChildren(self):
+        pdctl.PLACER_CLASS = pdctl.Placer
+        patch = self.pd.main
+        a = patch.A()
+        b = patch.B()
+        a.patch(b)
+        patch.render()
+
+        patch.interactive = False
+        c = patch.C()
+        a.out1.patch(c)
+        patch.render()
+        self.assertEquals((b.x + 80, b.y), (c.x, c.y))
+
+    def testClear(self):
+        patch = self.pd.main
+        patch.A()
+        patch.render()
+        patch.clear()
+        patch.interactive = False
+        b = patch.B()
+        patch.C(in0=b)
+        patch.render()
+        self.assertEquals(b'pd-__main__ connect 0 0 1 0;',
+                          self.sender.sent[-1])
+
+    def testClear_removedBoxesAreNotConnected(self):
+        patch = self.pd.main
+        a = patch.A()
+        patch.render()
+        patch.clear()
+        patch.interactive = False
+        b = patch.B()
+        a.patch(b)
+        b.patch(a)
+        del self.sender.sent[:]
+        patch.render()
+        self.assertEquals([b'pd-__main__ obj -1 -1 b;'], self.sender.sent)
+        self.assertFalse(a.is_placed())
+
+    def testUnrenderedBoxesAreNotConnected(self):
+        patch = self.pd.main
+        a = patch.A()
+        b = patch.B()
+        a.patch(pdctl.Obj(self.pd, 'x'))
+        a.patch(b)
+        patch.render()
+        patch.render()
+        self.assertEquals(
+            [
+                b'pd-__main__ obj -1 -1 a;',
+                b'pd-__main__ obj -1 -1 b;',
+                b'pd-__main__ connect 0 0 1 0;',
+            ],
+            self.sender.sent)
+
+    def testGuiPacing(self):
+        patch = self.pd.main
+        patch.Bang('b')
+        patch.Metro(500)
+        patch.render()
+        # The creation command and each mouse event are sent separately, and
+        # the final mouse event shares a batch with the following object.
+        self.assertEquals([1, 1, 1, 1, 2], self.sender.batches)
+        self.assertEquals(b'pd-__main__ bng b;', self.sender.sent[0])
+
+    def testBatch_failedSendEndsBatch(self):
+        def fail(cmds):
+            raise socket.error('broken pipe')
+        self.sender.send_many = fail
+        patch = self.pd.main
+        patch.A()
+        self.assertRaises(socket.error, patch.render)
+        self.pd.dsp(True)
+        self.assertEquals([b'pd dsp 1;'], self.sender.sent)
+
     def testInletsAndOutlets(self):
         patch = self.pd.main
         a = patch.A()
@@ -78,6 +178,65 @@ class PdTest(unittest.TestCase):
         self.assertEquals([b], list(a.children()))
         self.assertEquals([a], list(b.parents()))
 
+    def testParentAndChild(self):
+        patch = self.pd.main
+        a = patch.A()
+        b = patch.B()
+        c = patch.C()
+        self.assertEquals(None, a.parent())
+        self.assertEquals(None, a.child())
+        a.out1.patch(c.in1)
+        b.patch(c)
+        self.assertEquals(b, c.parent())
+        self.assertEquals(c, a.child())
+
+    def testPortsAreReused(self):
+        a = self.pd.main.A()
+        self.assertTrue(a.out1 is a.out1)
+        self.assertTrue(a.in0 is a.in0)
+        self.assertFalse(a.in1 is a.out1)
+        self.assertEquals(1, a.out1.idx)
+        self.assertFalse(hasattr(a, 'index'))
+        self.assertFalse(hasattr(a, 'outline'))
+        self.assertFalse(hasattr(a, 'render'))
+
+    def testPlacer_feedbackLoop(self):
+        patch = self.pd.main
+        bang = patch.Bang()
+        f = patch.F()
+        inc = patch.Plus(1)
+        bang.patch(f).patch(inc)
+        inc.patch(f.in1)
+        coords = pdctl.Placer().place_all(patch.boxes)
+        self.assertEquals(set([bang, f, inc]), set(coords))
+        self.assertEquals(coords[bang][1] + 20, coords[f][1])
+        self.assertEquals(coords[f][1] + 20, coords[inc][1])
+
+    def testPlacer_siblingOffsets(self):
+        patch = self.pd.main
+        a = patch.A()
+        b = patch.B()
+        c = patch.C()
+        d = patch.D()
+        a.out1.patch(c)
+        a.patch(b)
+        a.patch(d)
+        coords = pdctl.Placer().place_all(patch.boxes)
+        # Siblings are laid out left to right in outlet order, then in the
+        # order they were patched.
+        x, y = coords[a]
+        self.assertEquals((x, y + 20), coords[b])
+        self.assertEquals((x + 80, y + 20), coords[d])
+        self.assertEquals((x + 160, y + 20), coords[c])
+
+    def testPatchKeywordArgs(self):
+        patch = self.pd.main
+        a = patch.A()
+        b = patch.B()
+        c = patch.C(in0=a, in1=[a.out1, b])
+        self.assertEquals([a, a, b], list(c.parents()))
+        self.assertEquals([c, c], list(a.children()))
+
     def testSubpatch(self):
         patch = self.pd.main
         sub = patch.Canvas('foo')
@@ -121,9 +280,25 @@ class PdTest(unittest.TestCase):
                 ('Or', '|'),
                 ('Oror', '||'),
                 ('Phasor_', 'phasor~'),  # Note "or" substring in "phasor"
+                ('plus', '+'),
+                ('foo_', 'foo~'),
                 ]:
             self.assertEquals(replacement, pdctl._pd_obj_name(attr))
 
+    def testMsg(self):
+        patch = self.pd.main
+        patch.Msg(1, 2, ',', 3, 'a,b')
+        patch.render()
+        self.assertEquals(
+            [b'pd-__main__ msg -1 -1 1 2 \\, 3 a\\,b;'],
+            self.sender.sent)
+
+    def testToFudi(self):
+        self.assertEquals(b'foo 1 1.0 a\\;b;',
+                          pdctl.to_fudi(['foo', 1, 1.0, 'a;b']))
+        self.assertEquals(b'1.0 1;', pdctl.to_fudi([1.0, 1]))
+        self.assertEquals(b'0.0 -0.0;', pdctl.to_fudi([0.0, -0.0]))
+
     def testGetattr(self):
         """Tests for object class registration and access via getattr."""
         patch = self.pd.main
@@ -139,5 +314,76 @@ class PdTest(unittest.TestCase):
         bang = patch.Bang()
         self.assertTrue(isinstance(bang, pdctl.Bang))
 
+        # Creation functions are reused, and each call makes a new box.
+        self.assertTrue(patch.Lt_ is patch.Lt_)
+        self.assertFalse(patch.Lt_(0.5) is obj)
+        # Registered classes are real methods, not __getattr__ creators.
+        self.assertFalse('Bang' in patch._creators)
+
+        # Names starting with an underscore never create objects.
+        self.assertEquals(None, getattr(patch, '__deepcopy__', None))
+        self.assertFalse(hasattr(patch, '_repr_html_'))
+        self.assertFalse('__deepcopy__' in patch._creators)
+        self.assertFalse('_repr_html_' in patch._creators)
+
+
+class PdSendTest(unittest.TestCase):
+
+    def setUp(self):
+        # Bypass __init__, which connects to a running Pure Data.
+        self.sender = pdctl.PdSend.__new__(pdctl.PdSend)
+        self.sender.conn, self.receiver = socket.socketpair()
+
+    def tearDown(self):
+        self.sender.conn.close()
+        self.receiver.close()
+
+    def receive(self, size):
+        data = b''
+        while len(data) < size:
+            data += self.receiver.recv(size - len(data))
+        return data
+
+    def testSend(self):
+        self.sender.send(b'pd dsp 1;')
+        self.assertEquals(b'pd dsp 1;', self.receive(9))
+
+    def testSendMany(self):
+        self.sender.send_many([b'a 1;', b'b 2;', b'c;'])
+        self.assertEquals(b'a 1;\nb 2;\nc;', self.receive(12))
+
+    def testSendMany_large(self):
+        # Larger than a socket buffer, so sendall must write it in parts.
+        cmds = [b'pd-__main__ obj 10 10 metro 500;'] * 100000
+        expected = b'\n'.join(cmds)
+        received = []
+        reader = threading.Thread(
+            target=lambda: received.append(self.receive(len(expected))))
+        reader.start()
+        self.sender.send_many(cmds)
+        reader.join()
+        self.assertEquals(expected, received[0])
+
+    def testConnect(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        default_buffer = listener.getsockopt(
+            socket.SOL_SOCKET, socket.SO_SNDBUF)
+        sender = pdctl.PdSend(port=listener.getsockname()[1])
+        conn, _ = listener.accept()
+        try:
+            self.assertTrue(sender.conn.getsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY))
+            self.assertTrue(sender.conn.getsockopt(
+                socket.SOL_SOCKET, socket.SO_SNDBUF) > default_buffer)
+            sender.send(b'pd dsp 0;')
+            self.assertEquals(b'pd dsp 0;', conn.recv(9))
+        finally:
+            sender.conn.close()
+            conn.close()
+            listener.close()
+
+
 if __name__ == '__main__':
     unittest.main()